@@ -1,5 +1,5 @@
 from argparse import ArgumentParser
-from transformers import BertLMHeadModel, BertTokenizer, DataCollatorWithPadding
+from transformers import BertLMHeadModel, BertTokenizerFast, DataCollatorWithPadding
 import torch
 import json
 import re
@@ -7,6 +7,7 @@ from nltk.corpus import stopwords
 from tqdm import tqdm
 from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
+from tools import get_cls_logits
 import numpy as np
 import os
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -80,7 +81,7 @@ class MarcoEncodeDataset(Dataset):
 
 def main(args):
     model = BertLMHeadModel.from_pretrained("ielab/TILDE", cache_dir='./cache')
-    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', use_fast=True, cache_dir='./cache')
+    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased', cache_dir='./cache')
     model.eval().to(DEVICE)
     with open(os.path.join(args.output_dir, f"collection-tilde-expanded-top{args.topk}.jsonl"), 'w+') as wf:
         _, bad_ids = clean_vacab(tokenizer)
@@ -105,7 +106,7 @@ def main(args):
             passage_input_ids = batch.input_ids.numpy()
             batch.to(DEVICE)
             with torch.no_grad():
-                logits = model(**batch, return_dict=True).logits[:, 0]
+                logits = get_cls_logits(model, **batch)
                 batch_selected = torch.topk(logits, args.topk).indices.cpu().numpy()
 
             expansions = []
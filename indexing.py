@@ -1,7 +1,7 @@
 import torch
 from transformers import BertLMHeadModel, BertTokenizerFast
 from tqdm import tqdm
-from tools import get_stop_ids, load_run, load_collection, get_batch_text
+from tools import get_stop_ids, load_run, load_collection, get_batch_text, get_cls_logits
 import numpy as np
 import pickle
 import h5py
@@ -63,10 +63,10 @@ def main(args):
         passage_attention_mask = passage_inputs["attention_mask"].to(DEVICE)
 
         with torch.no_grad():
-            passage_outputs = model(input_ids=passage_input_ids,
-                                    token_type_ids=passage_token_type_ids,
-                                    attention_mask=passage_attention_mask,
-                                    return_dict=True).logits[:, 0]
+            passage_outputs = get_cls_logits(model,
+                                             input_ids=passage_input_ids,
+                                             token_type_ids=passage_token_type_ids,
+                                             attention_mask=passage_attention_mask)
             passage_probs = torch.sigmoid(passage_outputs)
             passage_log_probs = torch.squeeze(torch.log10(passage_probs)).cpu().numpy().astype(np.float16)
 
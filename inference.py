@@ -1,7 +1,7 @@
 import torch
 from transformers import BertLMHeadModel, BertTokenizerFast
 from tqdm import tqdm
-from tools import get_stop_ids, load_run, load_queries
+from tools import get_stop_ids, load_run, load_queries, get_cls_logits
 import numpy as np
 from timeit import default_timer as timer
 import h5py
@@ -54,10 +54,10 @@ def main(args):
             query_attention_mask = query_inputs["attention_mask"].to(DEVICE)
 
             with torch.no_grad():
-                query_outputs = model(input_ids=query_input_ids,
-                                      token_type_ids=query_token_type_ids,
-                                      attention_mask=query_attention_mask,
-                                      return_dict=True).logits[:, 0]
+                query_outputs = get_cls_logits(model,
+                                               input_ids=query_input_ids,
+                                               token_type_ids=query_token_type_ids,
+                                               attention_mask=query_attention_mask)
 
             query_probs = torch.sigmoid(query_outputs)
             query_log_probs = torch.log10(query_probs)[0].cpu().numpy()
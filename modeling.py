@@ -1,12 +1,25 @@
 import torch
-from transformers import PreTrainedModel, BertConfig, BertModel, BertLMHeadModel, BertTokenizer
+import torch.nn.functional as F
+from transformers import PreTrainedModel, BertConfig, BertModel, BertLMHeadModel, BertTokenizerFast
 from transformers.trainer import Trainer
 from torch.utils.data import DataLoader
 from typing import Optional
+import functools
 import os
 
 import pytorch_lightning as pl
-from tools import get_stop_ids
+from pytorch_lightning.strategies import DDPStrategy
+from tools import get_stop_ids, get_cls_logits
+
+
+@functools.lru_cache(maxsize=8)
+def _get_valid_tok_stats(model_type):
+    tokenizer = BertTokenizerFast.from_pretrained(model_type, cache_dir="./cache")
+    stop_ids = get_stop_ids(tokenizer)
+    num_valid_tok = tokenizer.vocab_size - len(stop_ids)
+    valid_tok_mask = torch.ones(tokenizer.vocab_size, dtype=torch.bool)
+    valid_tok_mask[sorted(stop_ids)] = False
+    return num_valid_tok, valid_tok_mask
 
 
 class TILDE(pl.LightningModule):
@@ -16,19 +29,25 @@ class TILDE(pl.LightningModule):
             self.bert = BertLMHeadModel.from_pretrained(from_pretrained, cache_dir="./cache")
         else:
             self.config = BertConfig.from_pretrained(model_type, cache_dir="./cache")
-            self.config.gradient_checkpointing = gradient_checkpointing  # for trade off training speed for larger batch size
             # self.config.is_decoder = True
             self.bert = BertLMHeadModel.from_pretrained(model_type, config=self.config, cache_dir="./cache")
+        if gradient_checkpointing:
+            # for trade off training speed for larger batch size, non-reentrant so ddp sees each param ready once
+            # even though passages and queries both go through self.bert every step
+            self.bert.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+
+        self.num_valid_tok, valid_tok_mask = _get_valid_tok_stats(model_type)
+        self.register_buffer('valid_tok_mask', valid_tok_mask.clone(), persistent=False)  # don't share the cached mask
 
-        self.tokenizer = BertTokenizer.from_pretrained(model_type, cache_dir="./cache")
-        self.num_valid_tok = self.tokenizer.vocab_size - len(get_stop_ids(self.tokenizer))
+    def cls_logits(self, input_ids, token_type_ids, attention_mask):
+        return get_cls_logits(self.bert,
+                              input_ids=input_ids,
+                              token_type_ids=token_type_ids,
+                              attention_mask=attention_mask)
 
     def forward(self, x):
         input_ids, token_type_ids, attention_mask = x
-        outputs = self.bert(input_ids=input_ids,
-                            token_type_ids=token_type_ids,
-                            attention_mask=attention_mask,
-                            return_dict=True).logits[:, 0]
+        outputs = self.cls_logits(input_ids, token_type_ids, attention_mask)
         return outputs
 
     # Bi-direction loss (BDQLM)
@@ -37,46 +56,30 @@ class TILDE(pl.LightningModule):
         passage_input_ids, passage_token_type_ids, passage_attention_mask, yqs, neg_yqs, \
         query_input_ids, query_token_type_ids, query_ttention_mask, yds, neg_yds = batch
 
-        passage_outputs = self.bert(input_ids=passage_input_ids,
-                                    token_type_ids=passage_token_type_ids,
-                                    attention_mask=passage_attention_mask,
-                                    return_dict=True).logits[:, 0]
-
-        query_outputs = self.bert(input_ids=query_input_ids,
-                                  token_type_ids=query_token_type_ids,
-                                  attention_mask=query_ttention_mask,
-                                  return_dict=True).logits[:, 0]
-
-        batch_size = len(yqs)
-        batch_passage_prob = torch.sigmoid(passage_outputs)
-        batch_query_prob = torch.sigmoid(query_outputs)
+        passage_outputs = self.cls_logits(passage_input_ids, passage_token_type_ids, passage_attention_mask)
+        query_outputs = self.cls_logits(query_input_ids, query_token_type_ids, query_ttention_mask)
 
-        passage_pos_loss = 0
-        query_pos_loss = 0
-        for i in range(batch_size):
-
-            # BCEWithLogitsLoss
-            passage_pos_ids_plus = torch.where(yqs[i] == 1)[0]
-            passage_pos_ids_minus = torch.where(yqs[i] == 0)[0]
-
-            passage_pos_probs = batch_passage_prob[i][passage_pos_ids_plus]
-            passage_neg_probs = batch_passage_prob[i][passage_pos_ids_minus]
-            passage_pos_loss -= torch.sum(torch.log(passage_pos_probs)) + torch.sum(torch.log(1-passage_neg_probs))
-
-            query_pos_ids_plus = torch.where(yds[i] == 1)[0]
-            query_pos_ids_minus = torch.where(yds[i] == 0)[0]
-
-            query_pos_probs = batch_query_prob[i][query_pos_ids_plus]
-            query_neg_probs = batch_query_prob[i][query_pos_ids_minus]
-            query_pos_loss -= torch.sum(torch.log(query_pos_probs)) + torch.sum(torch.log(1-query_neg_probs))
+        # BCEWithLogitsLoss, stop ids are masked out of the loss
+        valid_tok_weight = self.valid_tok_mask.float()
+        passage_pos_loss = F.binary_cross_entropy_with_logits(passage_outputs, (yqs == 1).float(),
+                                                              weight=valid_tok_weight, reduction='sum')
+        query_pos_loss = F.binary_cross_entropy_with_logits(query_outputs, (yds == 1).float(),
+                                                            weight=valid_tok_weight, reduction='sum')
 
         loss = (passage_pos_loss + query_pos_loss) / (self.num_valid_tok * 2)
 
         self.log("loss", loss)
         return loss
 
+    @staticmethod
+    def ddp_strategy():
+        # both passages and queries go through self.bert every step, so there are no unused parameters
+        return DDPStrategy(find_unused_parameters=False, gradient_as_bucket_view=True, bucket_cap_mb=50)
+
     def configure_optimizers(self):
-        optimizer = torch.optim.Adam(self.parameters(), lr=2e-5)
+        # weight_decay=0 keeps the update identical to Adam, fused kernels need the params on cuda
+        fused = self.device.type == 'cuda'
+        optimizer = torch.optim.AdamW(self.parameters(), lr=2e-5, weight_decay=0.0, fused=fused, foreach=not fused)
         return optimizer
 
     def save(self, path):
@@ -9,6 +9,7 @@ import os
 class TILDEv2(PreTrainedModel):
     config_class = BertConfig
     base_model_prefix = "tildev2"
+    supports_gradient_checkpointing = True
 
     def __init__(self, config: BertConfig, train_group_size=8):
         super().__init__(config)
@@ -46,57 +47,48 @@ class TILDEv2(PreTrainedModel):
     def forward(self, qry_in, doc_in):
         qry_input = qry_in
         doc_input = doc_in
-        doc_out = self.bert(**doc_input, return_dict=True)
-        doc_reps = self.tok_proj(doc_out.last_hidden_state)  # D * LD * d
 
+        doc_out = self.bert(**doc_input, return_dict=True, use_cache=False)
+        doc_reps = self.tok_proj(doc_out.last_hidden_state)  # D * LD * d
 
         doc_reps = torch.relu(doc_reps) # relu to make sure no negative weights
         doc_input_ids = doc_input['input_ids']
 
         # mask ingredients
         qry_input_ids = qry_input['input_ids']
-        qry_attention_mask = qry_input['attention_mask']
-        self.mask_sep(qry_attention_mask)
+        qry_attention_mask = qry_input['attention_mask']  # [SEP] is already masked out by the collator
 
-        qry_reps = torch.ones_like(qry_input_ids, dtype=torch.float32, device=doc_reps.device).unsqueeze(2)
         tok_scores = self.compute_tok_score_cart(
             doc_reps, doc_input_ids,
-            qry_reps, qry_input_ids, qry_attention_mask
+            qry_input_ids, qry_attention_mask
         )  # Q * D
 
-        scores = tok_scores
+        scores = tok_scores.float()  # keep the loss in fp32 under mixed precision
 
+        # the positive doc is the first of each query's group
         labels = torch.arange(
-            scores.size(0),
+            0, scores.size(1), self.train_group_size,
             device=doc_input['input_ids'].device,
             dtype=torch.long
         )
-
-        # offset the labels
-        labels = labels * self.train_group_size
         loss = self.cross_entropy(scores, labels)
         return loss, scores.view(-1)
 
-    def mask_sep(self, qry_attention_mask):
-        sep_pos = qry_attention_mask.sum(1).unsqueeze(1) - 1  # the sep token position
-        _zeros = torch.zeros_like(sep_pos)
-        qry_attention_mask.scatter_(1, sep_pos.long(), _zeros)
-        return qry_attention_mask
-
     # This function credits to Luyu gao: https://github.com/luyug/COIL/blob/main/modeling.py
-    def compute_tok_score_cart(self, doc_reps, doc_input_ids, qry_reps, qry_input_ids, qry_attention_mask):
-        qry_input_ids = qry_input_ids.unsqueeze(2).unsqueeze(3)  # Q * LQ * 1 * 1
-        doc_input_ids = doc_input_ids.unsqueeze(0).unsqueeze(1)  # 1 * 1 * D * LD
-        exact_match = doc_input_ids == qry_input_ids  # Q * LQ * D * LD
-        exact_match = exact_match.float()
-        scores_no_masking = torch.matmul(
-            qry_reps.view(-1, 1),  # (Q * LQ) * d
-            doc_reps.view(-1, 1).transpose(0, 1)  # d * (D * LD)
-        )
-        scores_no_masking = scores_no_masking.view(
-            *qry_reps.shape[:2], *doc_reps.shape[:2])  # Q * LQ * D * LD
-
-        scores, _ = (scores_no_masking * exact_match).max(dim=3)  # Q * LQ * D, max pooling
+    # static shapes are safe since the collator pads queries and docs to max_length
+    @torch.compile(fullgraph=True, dynamic=False)
+    def compute_tok_score_cart(self, doc_reps, doc_input_ids, qry_input_ids, qry_attention_mask):
+        # sort doc tokens by id, highest weight first among duplicates, so the first hit of a query token is its max
+        doc_weights = doc_reps.squeeze(2)  # D * LD
+        weight_order = doc_weights.argsort(dim=1, descending=True)
+        doc_ids_sorted, id_order = doc_input_ids.gather(1, weight_order).sort(dim=1, stable=True)
+        doc_idx_sorted = weight_order.gather(1, id_order)  # D * LD, positions in the original doc
+
+        qry_ids = qry_input_ids.reshape(1, -1).expand(doc_ids_sorted.size(0), -1).contiguous()  # D * (Q * LQ)
+        match_pos = torch.searchsorted(doc_ids_sorted, qry_ids).clamp_(max=doc_ids_sorted.size(1) - 1)
+        exact_match = doc_ids_sorted.gather(1, match_pos) == qry_ids
+        scores = doc_weights.gather(1, doc_idx_sorted.gather(1, match_pos)) * exact_match  # D * (Q * LQ), max pooling
+        scores = scores.view(-1, *qry_input_ids.shape).permute(1, 2, 0)  # Q * LQ * D
         tok_scores = (scores * qry_attention_mask.unsqueeze(2))[:, 1:].sum(1)
 
         return tok_scores
@@ -119,7 +111,7 @@ class TILDEv2Trainer(Trainer):
             prepared[k] = {}
             for sk, sv in v.items():
                 if isinstance(sv, torch.Tensor):
-                    prepared[k][sk] = sv.to(self.args.device)
+                    prepared[k][sk] = sv.to(self.args.device, non_blocking=True)
 
         return prepared
 
@@ -133,6 +125,7 @@ class TILDEv2Trainer(Trainer):
         if self.train_dataset is None:
             raise ValueError("Trainer: training requires a train_dataset.")
         train_sampler = self._get_train_sampler()
+        num_workers = self.args.dataloader_num_workers
 
         return DataLoader(
             self.train_dataset,
@@ -140,5 +133,9 @@ class TILDEv2Trainer(Trainer):
             sampler=train_sampler,
             collate_fn=self.data_collator,
             drop_last=True,
-            num_workers=self.args.dataloader_num_workers,
+            num_workers=num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            # keep workers alive across epochs, both options require worker processes
+            persistent_workers=num_workers > 0,
+            prefetch_factor=4 if num_workers > 0 else None,
         )
\ No newline at end of file
@@ -43,6 +43,12 @@ def get_batch_text(start, end, docids, collection):
     return batch_text
 
 
+def get_cls_logits(model, **inputs):
+    # only project the first token through the LM head, same as .logits[:, 0] without the B * L * V matmul
+    hidden = model.bert(**inputs, return_dict=True).last_hidden_state[:, 0]
+    return model.cls(hidden)
+
+
 def get_stop_ids(tok):
     # hard code for now, from nltk.corpus import stopwords, stopwords.words('english')
     stop_words = set(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've",
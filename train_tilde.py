@@ -1,5 +1,5 @@
 import pytorch_lightning as pl
-from transformers import BertTokenizer
+from transformers import BertTokenizerFast
 import torch
 from tools import get_stop_ids
 import random
@@ -12,7 +12,7 @@ import os
 
 
 MODEL_TYPE = 'bert-base-uncased'
-tokenizer = BertTokenizer.from_pretrained("bert-base-uncased", cache_dir='./cache')
+tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased", cache_dir='./cache')
 
 
 class CheckpointEveryEpoch(pl.Callback):
@@ -28,9 +28,9 @@ class CheckpointEveryEpoch(pl.Callback):
     ):
 
         self.start_epoc = start_epoc
-        self.file_path = save_path
+        self.save_path = save_path
 
-    def on_epoch_end(self, trainer: pl.Trainer, _):
+    def on_train_epoch_end(self, trainer: pl.Trainer, _):
         """ Check if we should save a checkpoint after every train epoch """
         epoch = trainer.current_epoch
         if epoch >= self.start_epoc:
@@ -40,7 +40,7 @@ class CheckpointEveryEpoch(pl.Callback):
 
 class MsmarcoDocumentQueryPair(Dataset):
     def __init__(self, path):
-        self.tokenizer = BertTokenizer.from_pretrained(MODEL_TYPE, cache_dir='./cache')
+        self.tokenizer = BertTokenizerFast.from_pretrained(MODEL_TYPE, cache_dir='./cache')
         self.path = path
         self.queries = []
         self.passages = []
@@ -139,23 +139,24 @@ def main(args):
                         collate_fn=collate_fn)
 
     trainer = Trainer(max_epochs=10,
-                      gpus=1,
-                      checkpoint_callback=False,
+                      accelerator='gpu',
+                      devices=args.gpus,
+                      strategy=TILDE.ddp_strategy() if args.gpus > 1 else 'auto',
+                      enable_checkpointing=False,
                       logger=tb_logger,
-                      # accelerator="ddp",
-                      # plugins='ddp_sharded',
                       callbacks=[CheckpointEveryEpoch(0, args.save_path)]
                       )
     trainer.fit(model, loader)
-    print("Saving the final checkpoint as a huggingface model...")
-    model_to_save = TILDE.load_from_checkpoint(model_type=MODEL_TYPE, checkpoint_path=os.path.join(args.save_path, 'epoch_10.ckpt'))
-    model_to_save.save(os.path.join(args.save_path, 'TILDE'))
+    if trainer.is_global_zero:  # with ddp every rank runs this, only save once
+        print("Saving the final checkpoint as a huggingface model...")
+        model_to_save = TILDE.load_from_checkpoint(model_type=MODEL_TYPE, checkpoint_path=os.path.join(args.save_path, 'epoch_10.ckpt'))
+        model_to_save.save(os.path.join(args.save_path, 'TILDE'))
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
-    parser = Trainer.add_argparse_args(parser)
     parser.add_argument("--train_path", required=True)
+    parser.add_argument("--gpus", type=int, default=1, help='number of GPUs, uses DDP when more than 1')
     parser.add_argument("--save_path", required=True)
     parser.add_argument("--gradient_checkpoint", action='store_true', help='Ture for trade off training speed for larger batch size')
     args = parser.parse_args()
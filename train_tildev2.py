@@ -50,6 +50,8 @@ class QryDocCollator(DataCollatorWithPadding):
             max_length=self.max_q_len,
             return_tensors="pt",
         )
+        q_attention_mask = q_collated['attention_mask']
+        q_attention_mask[torch.arange(len(qq)), q_attention_mask.sum(1) - 1] = 0  # mask the query [SEP] token
         d_collated = self.tokenizer.pad(
             dd,
             padding='max_length',